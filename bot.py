@@ -1,14 +1,30 @@
 # ==============================================================================
 # --- Required Libraries ---
 # ==============================================================================
+import asyncio
+import atexit
+import functools
+import hashlib
+import json
 import logging
 import os
-import google.generativeai as genai
-from datetime import date
+import queue
+import signal
+import time
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
+import numpy as np
+import redis.asyncio as redis
+from aiohttp import web
+from aiolimiter import AsyncLimiter
+from cachetools import TLRUCache, TTLCache
+from google.api_core import exceptions as google_exceptions
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.error import TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from flask import Flask      # For Azure health check
-import threading             # To run bot and web server together
+from telegram.helpers import escape_markdown
 
 # ==============================================================================
 # --- Secure Configuration ---
@@ -19,286 +35,845 @@ try:
     ADMIN_ID = int(os.environ.get('ADMIN_ID'))
 except (ValueError, TypeError):
     ADMIN_ID = None
+PORT = int(os.environ.get("PORT", 8000))
+# Public hostname for webhook mode. Azure App Service sets WEBSITE_HOSTNAME automatically;
+# without a hostname (e.g. local development) the bot falls back to polling.
+WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST') or os.environ.get('WEBSITE_HOSTNAME')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+TELEGRAM_POOL_SIZE = 50
+# Cached Gemini answers are saved here on shutdown and reloaded on startup.
+LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH', os.path.join('data', 'llm_cache.json'))
+# The semantic cache index is saved here as semantic_cache.npz.
+SEMANTIC_CACHE_DIR = os.environ.get('SEMANTIC_CACHE_DIR', 'data')
+SEMANTIC_CACHE_PATH = os.path.join(SEMANTIC_CACHE_DIR, 'semantic_cache.npz')
+# Optional: share daily-active-user counts across restarts and instances via Redis.
+REDIS_URL = os.environ.get('REDIS_URL')
 
 # ==============================================================================
 # --- Initial Setup & Validation ---
 # ==============================================================================
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Handlers only enqueue records; a background thread writes them out, so log I/O
+# never blocks the event loop.
+log_queue = queue.SimpleQueue()
+log_output = logging.StreamHandler()
+log_output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+log_listener = QueueListener(log_queue, log_output)
+logging.basicConfig(format='%(message)s', level=logging.INFO, handlers=[QueueHandler(log_queue)])
+log_listener.start()
+atexit.register(log_listener.stop)
 
 if not TELEGRAM_TOKEN or not GEMINI_API_KEY:
     logging.critical("CRITICAL ERROR: TELEGRAM_TOKEN or GEMINI_API_KEY environment variables are not set. Bot cannot start.")
     exit()
 
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    # --- THIS IS THE FIX: Using the correct, specific model name ---
-    model = genai.GenerativeModel('gemini-1.0-pro') # Use 'gemini-1.0-pro'
-    # --- END OF FIX ---
-    logging.info("Google AI configured successfully with model 'gemini-1.0-pro'.")
-except Exception as e:
-    logging.error(f"FATAL: Could not configure Google AI. Error: {e}")
-    exit()
+# The Gemini SDK (gRPC, protobuf, ...) takes a noticeable part of a second to import,
+# so it is loaded by init_model() at startup instead of at module import.
+genai = None
+model = None
+# Flipped once the startup warm-up call has finished; until then health checks answer 503.
+gemini_ready = False
 
-daily_users = {}
+def init_model():
+    """Imports and configures the Gemini SDK and creates the shared model."""
+    global genai, model
+    try:
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        # --- THIS IS THE FIX: Using the correct, specific model name ---
+        model = genai.GenerativeModel('gemini-1.0-pro') # Use 'gemini-1.0-pro'
+        # --- END OF FIX ---
+        logging.info("Google AI configured successfully with model 'gemini-1.0-pro'.")
+    except Exception as e:
+        logging.error("FATAL: Could not configure Google AI. Error: %s", e)
+        exit()
+
+# Caps how many Gemini requests may be in flight at once across all users.
+GEMINI_SEMAPHORE = asyncio.Semaphore(5)
+# Paces outgoing Gemini requests to stay under the per-minute quota (15 RPM).
+GEMINI_LIMITER = AsyncLimiter(15, 60)
+# Gemini errors worth retrying: rate limiting (429) and transient server-side failures (5xx).
+GEMINI_TRANSIENT_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+
+# Gemini answers keyed by normalized prompt, so repeated questions skip the API.
+# Keys are hashes of the normalized prompt, so the saved cache file holds no user text.
+# Entries are (answer, expiry as a Unix timestamp); wall-clock expiries let a saved
+# cache be restored with its remaining lifetime instead of a fresh TTL.
+RESPONSE_CACHE_TTL_SECONDS = 3600
+RESPONSE_CACHE = TLRUCache(maxsize=2048, ttu=lambda _key, entry, _now: entry[1], timer=time.time)
+# Fixed-prompt commands (/dsa, /idea) keep a pool of answers and rotate through it
+# once full; pools expire hourly so the answers get refreshed.
+RESPONSE_POOL_SIZE = 20
+response_pools = TTLCache(maxsize=16, ttl=3600)
+
+# Per-user guard for Gemini-backed handlers: one request in flight per user, and a
+# token bucket allowing bursts of 3 requests refilled at 1 per second. Buckets are
+# (tokens, last_update); an idle bucket is full again after BURST / RATE seconds,
+# so entries simply expire then.
+AI_RATE_PER_SECOND = 1.0
+AI_BURST = 3
+ai_in_flight: set[int] = set()
+ai_buckets = TTLCache(maxsize=10000, ttl=AI_BURST / AI_RATE_PER_SECOND)
+
+# Gemini answers currently being generated, keyed by cache key, so concurrent
+# identical prompts share one request instead of racing to fill the cache.
+gemini_in_flight: dict[str, asyncio.Future] = {}
+
+# Semantic cache for free-text messages: a paraphrase of an already answered
+# question ("what is recursion?" / "explain recursion") reuses its answer when the
+# cosine similarity of their embeddings is high enough. Vectors are normalized and
+# kept in a fixed-size ring buffer, so a lookup is one matrix-vector product.
+# Entries expire like RESPONSE_CACHE ones, at a wall-clock time kept per slot.
+SEMANTIC_CACHE_MODEL = "models/text-embedding-004"
+SEMANTIC_CACHE_THRESHOLD = 0.90
+SEMANTIC_CACHE_SIZE = 5000
+# The embedding only saves time if it is fast, so it gets one short attempt.
+SEMANTIC_EMBED_TIMEOUT_SECONDS = 3
+semantic_vectors = None # np.ndarray of shape (SEMANTIC_CACHE_SIZE, dim), allocated on first use
+semantic_answers: list[str] = []
+semantic_expiries = None # np.ndarray of Unix timestamps, one per slot
+semantic_next_slot = 0
+
+# Streamed answers are edited into place at most every 3 seconds (20 edits a
+# minute) and only once at least 40 new characters have arrived, to stay under
+# Telegram's per-chat rate limit.
+STREAM_EDIT_MIN_CHARS = 40
+STREAM_EDIT_INTERVAL_SECONDS = 3
+
+# Only today's active users are counted; the sketch is reset when the day rolls over.
+# Days are integer UTC buckets (seconds since the epoch // 86400). A HyperLogLog
+# with p=12 uses a few KB regardless of user count, at ~1.6% standard error. The
+# sketch is just its 2**12 one-byte registers in a NumPy array (see hll_add).
+SECONDS_PER_DAY = 86400
+HLL_PRECISION = 12
+current_day = int(time.time()) // SECONDS_PER_DAY
+today_users = np.zeros(1 << HLL_PRECISION, dtype=np.uint8)
+yesterday_user_count = 0
+
+# With REDIS_URL set, users are also added to a per-day Redis HyperLogLog (PFADD),
+# which survives restarts and is shared between instances. Keys expire after two
+# days. The in-memory sketch above remains the fallback if Redis is unavailable.
+DAU_KEY_TTL_SECONDS = 2 * SECONDS_PER_DAY
+# Short timeouts so an unreachable Redis fails fast instead of after redis-py's default 5 s.
+REDIS_TIMEOUT_SECONDS = 1
+redis_client = (
+    redis.from_url(REDIS_URL, socket_timeout=REDIS_TIMEOUT_SECONDS, socket_connect_timeout=REDIS_TIMEOUT_SECONDS)
+    if REDIS_URL else None
+)
+# Redis writes run in the background so replies never wait on them.
+redis_tasks: set[asyncio.Task] = set()
 
 # ==============================================================================
 # --- Helper Functions ---
 # ==============================================================================
 
-def track_user(user_id: int):
+def roll_day():
+    """Resets the active-user set when the day has changed since the last check."""
+    global current_day, today_users, yesterday_user_count
+    today = int(time.time()) // SECONDS_PER_DAY
+    if today != current_day:
+        yesterday_user_count = hll_count(today_users) if today - current_day == 1 else 0
+        current_day, today_users = today, np.zeros_like(today_users)
+
+def hll_add(registers, user_id: int):
+    """Adds a user to a HyperLogLog sketch; the hash picks a register, which keeps its longest run of leading zeros."""
+    bits = 64 - HLL_PRECISION
+    value = int.from_bytes(hashlib.sha1(str(user_id).encode()).digest()[:8], 'big')
+    index, rest = value >> bits, value & ((1 << bits) - 1)
+    registers[index] = max(registers[index], bits - rest.bit_length() + 1)
+
+def hll_count(registers) -> int:
+    """Estimates the number of distinct users added to a HyperLogLog sketch."""
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.exp2(-registers.astype(np.float64)))
+    empty = m - np.count_nonzero(registers)
+    if estimate <= 2.5 * m and empty:
+        estimate = m * np.log(m / empty) # Linear counting is more accurate for small counts
+    return int(round(estimate))
+
+def dau_key(day: int) -> str:
+    """Returns the Redis key holding the active users of a day bucket, e.g. 'dau:2026-10-15'."""
+    return "dau:" + time.strftime("%Y-%m-%d", time.gmtime(day * SECONDS_PER_DAY))
+
+async def track_user(user_id: int):
     """Tracks unique daily active users."""
-    today = date.today()
-    if today not in daily_users:
-        daily_users[today] = set()
-    daily_users[today].add(user_id)
-    # logging.info(f"Today's unique users: {len(daily_users[today])}") # Reduce log noise
-
-async def safe_reply(update: Update, text: str, **kwargs):
-    """Safely send replies and log any errors."""
-    if not update or not update.message:
-        logging.warning("safe_reply called with invalid update object.")
+    roll_day()
+    hll_add(today_users, user_id)
+    if redis_client is None:
         return
+    task = asyncio.create_task(add_redis_user(dau_key(current_day), user_id))
+    redis_tasks.add(task)
+    task.add_done_callback(redis_tasks.discard)
+
+async def add_redis_user(key: str, user_id: int):
+    """Adds a user to a day's Redis HyperLogLog and refreshes the key's expiry."""
     try:
-        await update.message.reply_text(text, **kwargs)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.pfadd(key, user_id)
+            pipe.expire(key, DAU_KEY_TTL_SECONDS)
+            await pipe.execute()
     except Exception as e:
-        logging.error(f"Telegram reply failed: {e}")
+        logging.warning("Redis user tracking failed: %s", e)
 
-# ==============================================================================
-# --- Command Handlers (Your Bot's Logic) ---
-# ==============================================================================
+async def count_day_users(day: int) -> int:
+    """Returns the unique active users of today or yesterday, preferring the shared Redis count."""
+    if redis_client is not None:
+        try:
+            return await redis_client.pfcount(dau_key(day))
+        except Exception as e:
+            logging.warning("Redis user count failed, using this instance's count: %s", e)
+    if day == current_day:
+        return hll_count(today_users)
+    return yesterday_user_count if day == current_day - 1 else 0
+
+gemini_retry = retry(
+    retry=retry_if_exception_type(GEMINI_TRANSIENT_ERRORS),
+    wait=wait_exponential_jitter(initial=1, max=16),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@gemini_retry
+async def call_gemini(prompt: str):
+    """Sends a prompt to Gemini without blocking the event loop, retrying transient failures."""
+    async with GEMINI_LIMITER, GEMINI_SEMAPHORE:
+        return await model.generate_content_async(prompt)
+
+@gemini_retry
+async def open_gemini_stream(prompt: str):
+    """Starts a streamed Gemini response. Callers must hold GEMINI_SEMAPHORE while consuming it."""
+    async with GEMINI_LIMITER:
+        return await model.generate_content_async(prompt, stream=True)
+
+async def stream_reply(update: Update, prompt: str, message=None) -> str:
+    """Streams Gemini's answer into one Telegram message, editing it as chunks arrive, and returns the full text.
+
+    The answer replaces the text of `message` (e.g. a placeholder) if given, otherwise it is sent as a new reply.
+    """
+    text = ""
+    shown_length = 0
+    last_edit = None
+    async with GEMINI_SEMAPHORE:
+        stream = await open_gemini_stream(prompt)
+        async for chunk in stream:
+            text += chunk.text
+            if not text.strip():
+                continue
+            now = time.monotonic()
+            if last_edit is not None and (
+                len(text) - shown_length < STREAM_EDIT_MIN_CHARS or now - last_edit < STREAM_EDIT_INTERVAL_SECONDS
+            ):
+                continue
+            last_edit = now
+            try:
+                if message is None:
+                    message = await update.message.reply_text(text)
+                else:
+                    await message.edit_text(text)
+            except TelegramError as e:
+                # A missed intermediate update (e.g. RetryAfter) is harmless; the final edit catches up.
+                logging.warning("Streaming edit failed, continuing: %s", e)
+                continue
+            shown_length = len(text)
+    if not text.strip():
+        raise ValueError("Gemini returned an empty response.")
+    if len(text) != shown_length:
+        await safe_edit(update, message, text)
+    return text
+
+def cache_key(prompt: str) -> str:
+    """Hashes a normalized prompt so trivially different spellings share a cache entry."""
+    return hashlib.sha256(prompt.strip().lower().encode()).hexdigest()
+
+def get_cached_answer(key: str) -> str | None:
+    """Returns the cached Gemini answer for a cache key, if it hasn't expired."""
+    entry = RESPONSE_CACHE.get(key)
+    return entry[0] if entry is not None else None
+
+def cache_answer(key: str, text: str, expires_at: float | None = None):
+    """Caches a Gemini answer until expires_at, by default for RESPONSE_CACHE_TTL_SECONDS."""
+    RESPONSE_CACHE[key] = (text, expires_at or time.time() + RESPONSE_CACHE_TTL_SECONDS)
+
+def load_response_cache():
+    """Restores cached Gemini answers saved by a previous run, unless they are older than the cache TTL."""
     try:
-        track_user(update.effective_user.id)
-        user_name = update.effective_user.first_name
-        welcome_message = (
-            f"Hello {user_name}! Main aapka AI dost hoon.\n\n"
-            "Coding, career, ya padhai se juda koi sawaal hai to pooch sakte ho!\n\n"
-            "Please use this bot responsibly. Use /help to see all available commands."
-        )
-        await safe_reply(update, welcome_message)
-    except Exception as e:
-        logging.error(f"Error in /start: {e}")
-
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if time.time() - os.path.getmtime(LLM_CACHE_PATH) > RESPONSE_CACHE_TTL_SECONDS:
+            return
+        with open(LLM_CACHE_PATH, encoding='utf-8') as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        logging.warning("Could not load the Gemini response cache: %s", e)
+        return
+    if not isinstance(entries, dict):
+        logging.warning("Ignoring the Gemini response cache: expected a JSON object, got %s.", type(entries).__name__)
+        return
+    now = time.time()
+    restored = [
+        (key, (entry[0], entry[1])) for key, entry in entries.items()
+        if isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], str)
+        and isinstance(entry[1], (int, float)) and entry[1] > now
+    ]
+    RESPONSE_CACHE.update(restored[-RESPONSE_CACHE.maxsize:])
+    logging.info("Loaded %s cached Gemini answers.", len(RESPONSE_CACHE))
+
+def save_response_cache():
+    """Writes the cached Gemini answers to disk so the next run starts warm."""
+    try:
+        os.makedirs(os.path.dirname(LLM_CACHE_PATH) or '.', exist_ok=True)
+        temp_path = LLM_CACHE_PATH + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(RESPONSE_CACHE), f, ensure_ascii=False)
+        os.replace(temp_path, LLM_CACHE_PATH)
+    except OSError as e:
+        logging.warning("Could not save the Gemini response cache: %s", e)
+
+async def embed_text(text: str):
+    """Returns the normalized embedding of a text, or None if it can't be computed."""
     try:
-        track_user(update.effective_user.id)
-        help_text = (
-            "Here are the available commands:\n\n"
-            "/start - To start or restart the bot\n"
-            "/help - Shows this list of commands\n"
-            "/website - Visit our official website\n"
-            "/roadmaps - Get a link to all career roadmaps\n"
-            "/blog - Get a link to our blog posts\n"
-            "/dsa - Get a random DSA practice problem\n"
-            "/connect - Connect with the developer\n"
-            "/idea - Get a new project idea\n"
-            "/explain [concept] - Ask the AI to explain a concept\n"
-            "/clear - Information on how to clear chat\n"
-            "/feedback [message] - Send your feedback"
+        result = await genai.embed_content_async(
+            model=SEMANTIC_CACHE_MODEL,
+            content=text,
+            request_options={"timeout": SEMANTIC_EMBED_TIMEOUT_SECONDS, "retry": None},
         )
-        await safe_reply(update, help_text)
     except Exception as e:
-        logging.error(f"Error in /help: {e}")
+        logging.warning("Embedding failed, skipping the semantic cache: %s", e)
+        return None
+    vector = np.asarray(result['embedding'], dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+def semantic_lookup(vector) -> tuple[str, float] | None:
+    """Returns the unexpired (answer, expiry) whose question is most similar to the vector, if similar enough."""
+    if vector is None or not semantic_answers or vector.shape[0] != semantic_vectors.shape[1]:
+        return None
+    count = len(semantic_answers)
+    scores = semantic_vectors[:count] @ vector
+    scores[semantic_expiries[:count] <= time.time()] = -1
+    best = int(np.argmax(scores))
+    if scores[best] < SEMANTIC_CACHE_THRESHOLD:
+        return None
+    return semantic_answers[best], float(semantic_expiries[best])
+
+def semantic_store(vector, answer: str):
+    """Adds a question's vector and answer to the semantic cache, overwriting the oldest entry when full."""
+    global semantic_vectors, semantic_answers, semantic_expiries, semantic_next_slot
+    if vector is None:
+        return
+    if semantic_vectors is None or semantic_vectors.shape[1] != vector.shape[0]:
+        semantic_vectors = np.zeros((SEMANTIC_CACHE_SIZE, vector.shape[0]), dtype=np.float32)
+        semantic_expiries = np.zeros(SEMANTIC_CACHE_SIZE)
+        semantic_answers, semantic_next_slot = [], 0
+    semantic_vectors[semantic_next_slot] = vector
+    semantic_expiries[semantic_next_slot] = time.time() + RESPONSE_CACHE_TTL_SECONDS
+    if semantic_next_slot < len(semantic_answers):
+        semantic_answers[semantic_next_slot] = answer
+    else:
+        semantic_answers.append(answer)
+    semantic_next_slot = (semantic_next_slot + 1) % SEMANTIC_CACHE_SIZE
 
-async def website(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def load_semantic_cache():
+    """Restores the unexpired part of the semantic cache saved by a previous run, if any."""
+    global semantic_vectors, semantic_answers, semantic_expiries, semantic_next_slot
     try:
-        track_user(update.effective_user.id)
-        website_url = "https://codewithmsmaxpro.me"
-        keyboard = [[InlineKeyboardButton("Visit Website", url=website_url)]]
-        await safe_reply(update, "Click the button below to visit our official website!", reply_markup=InlineKeyboardMarkup(keyboard))
-    except Exception as e:
-        logging.error(f"Error in /website: {e}")
-
-async def roadmaps(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        with np.load(SEMANTIC_CACHE_PATH) as saved:
+            vectors, expiries = saved['vectors'], saved['expiries']
+            answers = json.loads(saved['answers'].tobytes().decode('utf-8'))
+            next_slot = int(saved['next_slot'])
+    except FileNotFoundError:
+        return
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        logging.warning("Could not load the semantic cache: %s", e)
+        return
+    count = len(answers) if isinstance(answers, list) else -1
+    if (
+        vectors.ndim != 2 or not np.issubdtype(vectors.dtype, np.number)
+        or not all(isinstance(answer, str) for answer in answers)
+        or not 0 < count == len(vectors) == len(expiries) <= SEMANTIC_CACHE_SIZE
+        or not 0 <= next_slot < SEMANTIC_CACHE_SIZE
+    ):
+        logging.warning("Ignoring the semantic cache: unexpected file contents.")
+        return
+    # Oldest entry first (a full ring starts at next_slot), dropping expired ones, so
+    # the next eviction still hits the oldest entry.
+    order = np.roll(np.arange(count), -next_slot) if count == SEMANTIC_CACHE_SIZE else np.arange(count)
+    order = order[expiries[order] > time.time()]
+    if len(order) == 0:
+        return
+    semantic_vectors = np.zeros((SEMANTIC_CACHE_SIZE, vectors.shape[1]), dtype=np.float32)
+    semantic_vectors[:len(order)] = vectors[order]
+    semantic_expiries = np.zeros(SEMANTIC_CACHE_SIZE)
+    semantic_expiries[:len(order)] = expiries[order]
+    semantic_answers = [answers[i] for i in order]
+    semantic_next_slot = len(order) % SEMANTIC_CACHE_SIZE
+    logging.info("Loaded %s semantic cache entries.", len(order))
+
+def save_semantic_cache():
+    """Writes the semantic cache to disk so the next run starts warm."""
+    if not semantic_answers:
+        return
+    count = len(semantic_answers)
     try:
-        track_user(update.effective_user.id)
-        roadmaps_url = "https://codewithmsmaxpro.me/roadmaps.html"
-        keyboard = [[InlineKeyboardButton("View Roadmaps", url=roadmaps_url)]]
-        await safe_reply(update, "Click the button below to explore all the career roadmaps!", reply_markup=InlineKeyboardMarkup(keyboard))
+        os.makedirs(SEMANTIC_CACHE_DIR, exist_ok=True)
+        # One file, written atomically, so vectors and answers can never get out of step.
+        temp_path = SEMANTIC_CACHE_PATH + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                vectors=semantic_vectors[:count],
+                expiries=semantic_expiries[:count],
+                answers=np.frombuffer(json.dumps(semantic_answers, ensure_ascii=False).encode('utf-8'), dtype=np.uint8),
+                next_slot=semantic_next_slot,
+            )
+        os.replace(temp_path, SEMANTIC_CACHE_PATH)
+    except OSError as e:
+        logging.warning("Could not save the semantic cache: %s", e)
+
+async def single_flight(key: str, fetch) -> tuple[str, bool]:
+    """Runs fetch() unless a call for the same key is already in flight, in which case its result is shared.
+
+    Returns the result and whether this caller ran fetch() itself.
+    """
+    pending = gemini_in_flight.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending), False
+    future = asyncio.get_running_loop().create_future()
+    gemini_in_flight[key] = future
+    try:
+        result = await fetch()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
     except Exception as e:
-        logging.error(f"Error in /roadmaps: {e}")
+        future.set_exception(e)
+        future.exception() # Mark as retrieved in case nobody was waiting
+        raise
+    else:
+        future.set_result(result)
+        return result, True
+    finally:
+        del gemini_in_flight[key]
+
+def pooled_answer(prompt: str) -> str | None:
+    """Returns the next answer for a fixed prompt round-robin, or None while its pool is still filling."""
+    pool = response_pools.get(prompt)
+    if pool is None or len(pool) < RESPONSE_POOL_SIZE:
+        return None
+    text = pool[0]
+    pool.rotate(-1)
+    return text
+
+def add_pooled_answer(prompt: str, text: str):
+    """Adds a freshly generated answer to a fixed prompt's pool unless it is already full."""
+    pool = response_pools.get(prompt)
+    if pool is None:
+        pool = response_pools[prompt] = deque()
+    if len(pool) < RESPONSE_POOL_SIZE:
+        pool.append(text)
+
+def take_ai_token(user_id: int) -> bool:
+    """Takes one token from the user's bucket; returns False if it is empty."""
+    now = time.monotonic()
+    tokens, last_update = ai_buckets.get(user_id, (AI_BURST, now))
+    tokens = min(AI_BURST, tokens + (now - last_update) * AI_RATE_PER_SECOND)
+    allowed = tokens >= 1
+    ai_buckets[user_id] = (tokens - 1 if allowed else tokens, now)
+    return allowed
+
+def limit_ai_requests(handler):
+    """Wraps a Gemini-backed handler with the per-user in-flight check and rate limit."""
+    @functools.wraps(handler)
+    async def guarded(update: Update, *args) -> None:
+        # Edited messages and channel posts also pass the text filter; they have
+        # nothing to reply to, so they must not use up the user's tokens.
+        if not update.message or not update.effective_user:
+            return
+        user_id = update.effective_user.id
+        if user_id in ai_in_flight:
+            await safe_reply(update, "Still working on your previous request...")
+            return
+        if not take_ai_token(user_id):
+            await safe_reply(update, "Please slow down a little and try again in a few seconds.")
+            return
+        ai_in_flight.add(user_id)
+        try:
+            await handler(update, *args)
+        finally:
+            ai_in_flight.discard(user_id)
+    return guarded
 
-async def blog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def safe_reply(update: Update, text: str, **kwargs):
+    """Safely send replies and log any errors. Returns the sent message, or None on failure."""
+    if not update or not update.message:
+        logging.warning("safe_reply called with invalid update object.")
+        return None
     try:
-        track_user(update.effective_user.id)
-        blog_url = "https://codewithmsmaxpro.me/blog.html"
-        keyboard = [[InlineKeyboardButton("Read Blog", url=blog_url)]]
-        await safe_reply(update, "Click the button below to read our latest blog posts.", reply_markup=InlineKeyboardMarkup(keyboard))
+        return await update.message.reply_text(text, **kwargs)
     except Exception as e:
-        logging.error(f"Error in /blog: {e}")
+        logging.error("Telegram reply failed: %s", e)
+        return None
 
+async def safe_edit(update: Update, message, text: str, **kwargs):
+    """Replaces a placeholder message's text, falling back to a new reply if there is no placeholder or the edit fails."""
+    if message is not None:
+        try:
+            return await message.edit_text(text, **kwargs)
+        except Exception as e:
+            logging.error("Telegram edit failed: %s", e)
+    return await safe_reply(update, text, **kwargs)
+
+async def reply_from_pool(update: Update, placeholder, prompt: str):
+    """Answers a fixed prompt in the placeholder: from its pool if full, otherwise by streaming a new answer."""
+    text = pooled_answer(prompt)
+    if text is not None:
+        await safe_edit(update, placeholder, text)
+    else:
+        add_pooled_answer(prompt, await stream_reply(update, prompt, placeholder))
+
+# ==============================================================================
+# --- Command Handlers (Your Bot's Logic) ---
+# ==============================================================================
+
+# Link keyboards never change, so they are built once at import time.
+WEBSITE_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Visit Website", url="https://codewithmsmaxpro.me")],
+])
+ROADMAPS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("View Roadmaps", url="https://codewithmsmaxpro.me/roadmaps.html")],
+])
+BLOG_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Read Blog", url="https://codewithmsmaxpro.me/blog.html")],
+])
+CONNECT_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("GitHub", url="https://github.com/MSMAXPRO")],
+    [InlineKeyboardButton("LinkedIn", url="https://linkedin.com/in/your-linkedin-username")], # <-- IMPORTANT: Update this URL
+])
+
+def make_link_handler(command: str, text: str, markup: InlineKeyboardMarkup):
+    """Builds a command handler that replies with text and a prebuilt link keyboard."""
+    async def link_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await track_user(update.effective_user.id)
+        await safe_reply(update, text, reply_markup=markup)
+    link_handler.__name__ = f"{command}_handler"
+    return link_handler
+
+WELCOME_PREFIX = "Hello "
+WELCOME_SUFFIX = (
+    "! Main aapka AI dost hoon.\n\n"
+    "Coding, career, ya padhai se juda koi sawaal hai to pooch sakte ho!\n\n"
+    "Please use this bot responsibly. Use /help to see all available commands."
+)
+
+CLEAR_CHAT_TEXT = (
+    "For your privacy, a Telegram bot cannot clear your chat history.\n\n"
+    "To clear the chat, please tap the three dots (⋮) at the top right of this chat and select 'Clear history'."
+)
+CLEAR_CHAT_TEXT_MD = escape_markdown(CLEAR_CHAT_TEXT, version=2)
+
+# Reference texts (/help, /clear) are sent as pre-escaped MarkdownV2 and without a
+# push notification, since the user is looking at the chat anyway.
+REFERENCE_REPLY_OPTIONS = {"parse_mode": ParseMode.MARKDOWN_V2, "disable_notification": True}
+
+# Gemini prompts and the messages around them; '{}' is filled with the concept.
+DSA_PROMPT = "Give me a beginner-friendly DSA (Data Structures and Algorithms) practice problem. State the problem clearly, provide a hint, but do not provide the solution."
+IDEA_PROMPT = "Give me a simple but interesting project idea for a beginner programmer. Explain it in 2-3 lines."
+EXPLAIN_PROMPT = "Explain the concept of '{}' in a simple and easy-to-understand way for a beginner student."
+EXPLAIN_THINKING = "Thinking... Let me explain '{}' for you."
+EXPLAIN_ERROR = "Sorry, I couldn't explain '{}' right now. Please try again later."
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await track_user(update.effective_user.id)
+    await safe_reply(update, WELCOME_PREFIX + update.effective_user.first_name + WELCOME_SUFFIX)
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await track_user(update.effective_user.id)
+    await safe_reply(update, HELP_TEXT_MD, **REFERENCE_REPLY_OPTIONS)
+
+@limit_ai_requests
 async def dsa(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    track_user(update.effective_user.id) # Track usage for AI commands too
-    await safe_reply(update, "Finding a good DSA problem for you...")
+    await track_user(update.effective_user.id) # Track usage for AI commands too
+    placeholder = await safe_reply(update, "Finding a good DSA problem for you...")
     try:
-        prompt = "Give me a beginner-friendly DSA (Data Structures and Algorithms) practice problem. State the problem clearly, provide a hint, but do not provide the solution."
-        response = model.generate_content(prompt)
-        await safe_reply(update, response.text)
+        await reply_from_pool(update, placeholder, DSA_PROMPT)
     except Exception as e:
-        logging.error(f"--- GEMINI ERROR (in /dsa) --- \n Error: {e}")
-        await safe_reply(update, "Sorry, I couldn't find a problem right now. Please try again later.")
+        logging.error("--- GEMINI ERROR (in /dsa) --- \n Error: %s", e)
+        await safe_edit(update, placeholder, "Sorry, I couldn't find a problem right now. Please try again later.")
         
-async def connect(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    try:
-        track_user(update.effective_user.id)
-        github_url = "https://github.com/MSMAXPRO"
-        linkedin_url = "https://linkedin.com/in/your-linkedin-username" # <-- IMPORTANT: Update this URL
-        keyboard = [
-            [InlineKeyboardButton("GitHub", url=github_url)],
-            [InlineKeyboardButton("LinkedIn", url=linkedin_url)]
-        ]
-        await safe_reply(update, "You can connect with me on these platforms:", reply_markup=InlineKeyboardMarkup(keyboard))
-    except Exception as e:
-        logging.error(f"Error in /connect: {e}")
-
+@limit_ai_requests
 async def idea(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    track_user(update.effective_user.id)
-    await safe_reply(update, "Thinking of a new idea for you...")
+    await track_user(update.effective_user.id)
+    placeholder = await safe_reply(update, "Thinking of a new idea for you...")
     try:
-        prompt = "Give me a simple but interesting project idea for a beginner programmer. Explain it in 2-3 lines."
-        response = model.generate_content(prompt)
-        await safe_reply(update, response.text)
+        await reply_from_pool(update, placeholder, IDEA_PROMPT)
     except Exception as e:
-        logging.error(f"--- GEMINI ERROR (in /idea) --- \n Error: {e}")
-        await safe_reply(update, "Sorry, I couldn't think of an idea right now. Please try again later.")
+        logging.error("--- GEMINI ERROR (in /idea) --- \n Error: %s", e)
+        await safe_edit(update, placeholder, "Sorry, I couldn't think of an idea right now. Please try again later.")
 
 async def explain(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    track_user(update.effective_user.id)
+    await track_user(update.effective_user.id)
     if not context.args:
         await safe_reply(update, "Please provide a concept to explain. Example: /explain Python lists")
         return
-    
-    concept = ' '.join(context.args)
-    await safe_reply(update, f"Thinking... Let me explain '{concept}' for you.")
+    await explain_concept(update, ' '.join(context.args))
+
+@limit_ai_requests
+async def explain_concept(update: Update, concept: str) -> None:
+    placeholder = await safe_reply(update, EXPLAIN_THINKING.format(concept))
+    prompt = EXPLAIN_PROMPT.format(concept)
+    key = cache_key(prompt)
     try:
-        prompt = f"Explain the concept of '{concept}' in a simple and easy-to-understand way for a beginner student."
-        response = model.generate_content(prompt)
-        await safe_reply(update, response.text)
+        answer = get_cached_answer(key)
+        if answer is not None:
+            await safe_edit(update, placeholder, answer)
+            return
+        # Explanations are the longest answers, so fresh ones are streamed into the placeholder.
+        answer, streamed = await single_flight(key, functools.partial(stream_reply, update, prompt, placeholder))
+        if streamed:
+            cache_answer(key, answer)
+        else:
+            await safe_edit(update, placeholder, answer)
     except Exception as e:
-        logging.error(f"--- GEMINI ERROR (in /explain) --- \n Error: {e}")
-        await safe_reply(update, f"Sorry, I couldn't explain '{concept}' right now. Please try again later.")
+        logging.error("--- GEMINI ERROR (in /explain) --- \n Error: %s", e)
+        await safe_edit(update, placeholder, EXPLAIN_ERROR.format(concept))
 
 async def clear_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    try:
-        track_user(update.effective_user.id)
-        info_text = "For your privacy, a Telegram bot cannot clear your chat history.\n\nTo clear the chat, please tap the three dots (⋮) at the top right of this chat and select 'Clear history'."
-        await safe_reply(update, info_text)
-    except Exception as e:
-        logging.error(f"Error in /clear: {e}")
+    await track_user(update.effective_user.id)
+    await safe_reply(update, CLEAR_CHAT_TEXT_MD, **REFERENCE_REPLY_OPTIONS)
 
 
 async def feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    try:
-        track_user(update.effective_user.id)
-        if not context.args:
-            await safe_reply(update, "Please write your feedback after the command. Example: /feedback This is a great bot!")
-            return
-        
-        feedback_message = ' '.join(context.args)
-        user_name = update.effective_user.username or update.effective_user.first_name
-        logging.info(f"FEEDBACK Received from {user_name}: {feedback_message}")
-        await safe_reply(update, "Thank you for your feedback! It has been sent to the developer.")
-    except Exception as e:
-        logging.error(f"Error in /feedback: {e}")
+    user = update.effective_user
+    await track_user(user.id)
+    if not context.args:
+        await safe_reply(update, "Please write your feedback after the command. Example: /feedback This is a great bot!")
+        return
+
+    feedback_message = ' '.join(context.args)
+    user_name = user.username or user.first_name
+    logging.info("FEEDBACK Received from %s: %s", user_name, feedback_message)
+    await safe_reply(update, "Thank you for your feedback! It has been sent to the developer.")
 
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if ADMIN_ID and update.effective_user.id == ADMIN_ID:
-        try:
-            user_count = len(daily_users.get(date.today(), set()))
-            await safe_reply(update, f"📊 Today's unique active users: {user_count}")
-        except Exception as e:
-            logging.error(f"Error in /stats: {e}")
+        roll_day()
+        today_count = await count_day_users(current_day)
+        yesterday_count = await count_day_users(current_day - 1)
+        await safe_reply(
+            update,
+            f"📊 Today's unique active users: {today_count}\n"
+            f"Yesterday's unique active users: {yesterday_count}"
+        )
     else:
-        logging.warning(f"Unauthorized access attempt for /stats by user {update.effective_user.id}")
+        logging.warning("Unauthorized access attempt for /stats by user %s", update.effective_user.id)
 
 
+@limit_ai_requests
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles non-command messages by sending them to the Gemini AI."""
     if not update.message or not update.message.text:
         logging.warning("Received an update without a message text.")
         return # Ignore updates without text
 
-    track_user(update.effective_user.id)
+    await track_user(update.effective_user.id)
     user_message = update.message.text
     try:
-        logging.info(f"Attempting Gemini generation for: '{user_message}'")
-        if 'model' not in globals():
-             logging.error("FATAL: Gemini 'model' is not defined globally.")
-             await safe_reply(update, "Internal configuration error. Please contact admin.")
-             return
-
-        response = model.generate_content(user_message) # Make the AI call
-        await safe_reply(update, response.text)
-        logging.info("Successfully sent Gemini AI response.")
+        logging.info("Gemini request from user=%s len=%d", update.effective_user.id, len(user_message))
+        key = cache_key(user_message)
+        answer = get_cached_answer(key)
+        if answer is None and key in gemini_in_flight:
+            # Someone else is already asking exactly this; share their answer.
+            answer = await asyncio.shield(gemini_in_flight[key])
+        vector = None
+        if answer is None:
+            vector = await embed_text(user_message)
+            entry = semantic_lookup(vector)
+            if entry is not None:
+                # Copied with its own expiry, so a semantic hit can't outlive the original answer.
+                answer, expires_at = entry
+                cache_answer(key, answer, expires_at)
+        if answer is not None:
+            await safe_reply(update, answer)
+        else:
+            # Stream fresh answers so the user starts reading before Gemini finishes.
+            answer, streamed = await single_flight(key, functools.partial(stream_reply, update, user_message))
+            if streamed:
+                cache_answer(key, answer)
+                semantic_store(vector, answer)
+            else:
+                await safe_reply(update, answer)
+        logging.debug("Successfully sent Gemini AI response.")
     except Exception as e:
-        logging.error(f"--- GEMINI ERROR ---")
-        logging.error(f"Failed to get AI response for message: '{user_message}'")
-        logging.error(f"Error Type: {type(e).__name__}")
-        logging.error(f"Error Details: {e}")
-        logging.error(f"--------------------")
+        logging.error("--- GEMINI ERROR ---")
+        logging.error("Failed to get AI response for message: '%s'", user_message)
+        logging.error("Error Type: %s", type(e).__name__)
+        logging.error("Error Details: %s", e)
+        logging.error("--------------------")
         await safe_reply(update, "Sorry, I'm having an issue connecting to my AI brain right now. The admin has been notified.")
 
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Logs any exception a handler didn't handle itself."""
+    logging.error("Handler failed: %s", context.error, exc_info=context.error)
+
+# Plain text that isn't a command goes to handle_message; built once and shared.
+TEXT_FILTER = filters.TEXT & ~filters.COMMAND
+
+# Every bot command: (name, handler, argument hint, /help description).
+# This table drives both handler registration and HELP_TEXT; commands without a
+# description (admin-only) are left out of /help.
+COMMANDS = [
+    ("start", start, "", "To start or restart the bot"),
+    ("help", help_command, "", "Shows this list of commands"),
+    ("website", make_link_handler("website", "Click the button below to visit our official website!", WEBSITE_MARKUP),
+        "", "Visit our official website"),
+    ("roadmaps", make_link_handler("roadmaps", "Click the button below to explore all the career roadmaps!", ROADMAPS_MARKUP),
+        "", "Get a link to all career roadmaps"),
+    ("blog", make_link_handler("blog", "Click the button below to read our latest blog posts.", BLOG_MARKUP),
+        "", "Get a link to our blog posts"),
+    ("dsa", dsa, "", "Get a random DSA practice problem"),
+    ("connect", make_link_handler("connect", "You can connect with me on these platforms:", CONNECT_MARKUP),
+        "", "Connect with the developer"),
+    ("idea", idea, "", "Get a new project idea"),
+    ("explain", explain, "[concept]", "Ask the AI to explain a concept"),
+    ("clear", clear_chat, "", "Information on how to clear chat"),
+    ("feedback", feedback, "[message]", "Send your feedback"),
+    ("stats", stats, "", None),
+]
+
+HELP_TEXT = "Here are the available commands:\n\n" + "\n".join(
+    f"/{name} {args} - {description}" if args else f"/{name} - {description}"
+    for name, _, args, description in COMMANDS
+    if description
+)
+HELP_TEXT_MD = escape_markdown(HELP_TEXT, version=2)
+
 # ==============================================================================
-# --- Dummy Web Server (For Azure Health Check) ---
+# --- Web Server (Telegram Webhook + Azure Health Check) ---
 # ==============================================================================
-flask_app = Flask(__name__)
+APPLICATION_KEY = web.AppKey("application", Application)
+
+async def index(request: web.Request) -> web.Response:
+    if not gemini_ready:
+        return web.Response(status=503, text="Warming up.")
+    return web.Response(text="Hello! The Telegram Bot is running in the background.")
+
+async def telegram_webhook(request: web.Request) -> web.Response:
+    """Receives an update pushed by Telegram and queues it for the bot."""
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    application = request.app[APPLICATION_KEY]
+    await application.update_queue.put(Update.de_json(await request.json(), application.bot))
+    return web.Response()
+
+def build_web_app(application: Application) -> web.Application:
+    """Builds the web server that answers health checks and, in webhook mode, Telegram updates."""
+    web_app = web.Application()
+    web_app[APPLICATION_KEY] = application
+    web_app.router.add_get("/", index)
+    web_app.router.add_get("/healthz", index)
+    if WEBHOOK_HOST:
+        web_app.router.add_post(f"/{TELEGRAM_TOKEN}", telegram_webhook)
+    return web_app
 
-@flask_app.route('/')
-def index():
-    logging.info("Web server health check received.")
-    return "Hello! The Telegram Bot is running in the background."
-
-def run_web_server():
-    port = int(os.environ.get("PORT", 8000))
-    logging.info(f"Starting Flask web server on port {port}.")
-    try:
-        flask_app.run(host='0.0.0.0', port=port)
-    except Exception as e:
-        logging.error(f"Web server failed to start: {e}")
-    
 # ==============================================================================
 # --- Main Application Start ---
 # ==============================================================================
-def run_bot():
-    """Initializes and runs the Telegram bot's polling mechanism."""
+def build_application() -> Application:
+    """Creates the Telegram application with all handlers registered."""
+    # Bot API calls share one pooled HTTP/2 client, so concurrent replies and edits
+    # reuse connections instead of paying for new TLS handshakes. getUpdates stays on
+    # HTTP/1.1: long polling gains nothing from HTTP/2, which is less stable there.
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .http_version("2")
+        .connection_pool_size(TELEGRAM_POOL_SIZE)
+        .build()
+    )
+
+    # Register all command handlers
+    for command, handler, _, _ in COMMANDS:
+        application.add_handler(CommandHandler(command, handler))
+
+    application.add_handler(MessageHandler(TEXT_FILTER, handle_message))
+    application.add_error_handler(on_error)
+    return application
+
+async def warm_up_gemini():
+    """Sends one tiny prompt so Gemini's channel and auth token are ready before the first user arrives."""
+    global gemini_ready
     try:
-        application = Application.builder().token(TELEGRAM_TOKEN).build()
-        
-        # Register all command handlers
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("website", website))
-        application.add_handler(CommandHandler("roadmaps", roadmaps))
-        application.add_handler(CommandHandler("blog", blog))
-        application.add_handler(CommandHandler("dsa", dsa))
-        application.add_handler(CommandHandler("connect", connect))
-        application.add_handler(CommandHandler("idea", idea))
-        application.add_handler(CommandHandler("explain", explain))
-        application.add_handler(CommandHandler("clear", clear_chat))
-        application.add_handler(CommandHandler("feedback", feedback))
-        application.add_handler(CommandHandler("stats", stats))
-        
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-        
-        logging.info("Bot polling starting...")
-        application.run_polling() 
-        logging.info("Bot polling stopped.") 
+        await call_gemini("ping")
+        logging.info("Gemini warm-up complete.")
+    except Exception as e:
+        logging.warning("Gemini warm-up failed, continuing without it: %s", e)
+    finally:
+        gemini_ready = True
+
+async def serve(application: Application):
+    """Runs the bot and the web server on one event loop until SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass # Windows: Ctrl+C still raises KeyboardInterrupt
+
+    # No access log: Azure probes the health check every few seconds.
+    # The web server comes up first so the probe gets a 503 while we start, not a refused connection.
+    web_runner = web.AppRunner(build_web_app(application), access_log=None)
+    await web_runner.setup()
+    await web.TCPSite(web_runner, "0.0.0.0", PORT).start()
+    logging.info("Web server listening on port %s.", PORT)
+    try:
+        init_model()
+        load_response_cache()
+        load_semantic_cache()
+        async with application:
+            # Warm Gemini up in the background while the bot connects to Telegram.
+            warm_up = asyncio.create_task(warm_up_gemini())
+            if WEBHOOK_HOST:
+                # Telegram pushes updates to https://<host>/<token>, served by our own web server.
+                await application.bot.set_webhook(
+                    url=f"https://{WEBHOOK_HOST}/{TELEGRAM_TOKEN}",
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+                logging.info("Bot webhook set for host %s.", WEBHOOK_HOST)
+            else:
+                await application.updater.start_polling()
+                logging.info("Bot polling started.")
+            await application.start()
+            try:
+                await stop.wait()
+            finally:
+                warm_up.cancel()
+                if application.updater.running:
+                    await application.updater.stop()
+                await application.stop()
+                if redis_client is not None:
+                    await redis_client.aclose()
+                save_response_cache()
+                save_semantic_cache()
+                logging.info("Bot stopped.")
+    finally:
+        await web_runner.cleanup()
 
+def run_bot():
+    """Initializes the Telegram bot and serves it until shutdown."""
+    try:
+        asyncio.run(serve(build_application()))
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
-        logging.critical(f"CRITICAL ERROR starting Telegram bot: {e}")
-        exit() 
+        logging.critical("CRITICAL ERROR starting Telegram bot: %s", e)
+        exit()
 
 if __name__ == '__main__':
     logging.info("Starting application...")
-
-    web_server_thread = threading.Thread(target=run_web_server)
-    web_server_thread.daemon = True 
-    web_server_thread.start()
-    logging.info("Web server thread started.")
-
     run_bot()
-